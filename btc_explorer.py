@@ -3,6 +3,10 @@ import requests
 import json
 import time
 import pprint
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import date, datetime, time as dtime, timezone
 import pandas as pd
 
 bc_printer = pprint.PrettyPrinter(indent=3)
@@ -19,6 +23,16 @@ class ApiEndpoint:
             address data.
         transact: String appended to the end of the base to
             retrieve transactional data.
+        name: Short name of the provider used when reporting
+            statistics.
+        status: HTTP Status Code of the most recent request or
+            None if the request never completed.
+        remaining: Requests left in the provider's quota as
+            reported by the API, or None if unknown.
+        metered: False if the provider has no request quota.
+        delay: Minimum seconds between two requests to the API.
+        latency: Seconds spent waiting on the API during the
+            latest getAddress or getTransaction call.
     """
 
     def __init__(self):
@@ -31,6 +45,13 @@ class ApiEndpoint:
         self.base = None
         self.address = None
         self.transact = None
+        self.name = None
+        self.status = None
+        self.remaining = None
+        self.metered = True
+        self.delay = 2
+        self.last_request = 0
+        self.latency = 0.0
 
     def getBase(self):
         """Returns the base API URL
@@ -39,11 +60,65 @@ class ApiEndpoint:
         """
         return self.base
 
+    def pace(self):
+        """Waits until the API may be polled again
+
+        Sleeps until delay seconds have passed since the previous
+        request so that we stay within the API request limits.
+        """
+        pause = self.last_request + self.delay - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+    def fetch(self, url, params = None):
+        """Polls the API
+
+        Paces the request, then records its status, quota and the
+        time spent waiting on the API.
+
+        Args:
+            url: Full URL of the request
+            params: Optional dictionary of query parameters
+
+        Returns: requests Response object from the API
+        """
+        self.pace()
+        start = time.monotonic()
+        try:
+            response = requests.get(url, params = params)
+        finally:
+            self.last_request = time.monotonic()
+        self.latency += self.last_request - start
+        self.recordResponse(response)
+        return response
+
+    def recordResponse(self, response):
+        """Records the status and quota of a response
+
+        Keeps track of the outcome of the latest request so that
+        callers such as ProviderRouter can tell a rate limit or
+        server error apart from a missing address. Providers which
+        report their remaining quota in the X-Ratelimit-Remaining
+        header have it stored in remaining.
+
+        Args:
+            response: requests Response object from the API
+        """
+        self.status = response.status_code
+        quota = response.headers.get("X-Ratelimit-Remaining")
+        if quota is not None:
+            try:
+                self.remaining = int(quota)
+            except ValueError:
+                pass
+
     def getAddress(self, addr):
         """Retrieves data for an address
 
         Polls the API Addr Endpoint and returns the JSON
-        object received from the API.
+        object received from the API. Subclasses accept an
+        optional CrawlScope and push its bounds into the
+        request where the API supports them.
 
         Args:
             addr: Hash of the address object in the blockchain.
@@ -104,58 +179,603 @@ class ApiEndpoint:
 
 class Blockcypher(ApiEndpoint):
     def __init__(self):
+        super().__init__()
         self.base = "https://api.blockcypher.com/v1/btc/main"
         self.address = "/addrs/"
         self.transact = "/txs/"
+        self.name = "blockcypher"
+        self.txlimit = 50
 
-    def getAddress(self, addr, full = False):
+    def getAddress(self, addr, full = False, scope = None):
         api_call = self.base+self.address+addr
         if full:
-            api_call = api_call + "/full?txlimit=50"
+            api_call = api_call + "/full?txlimit=" + str(self.txlimit)
+        params = scope.heightParams() if scope else {}
+        self.status = None
+        self.latency = 0.0
         try:
-            response = requests.get(api_call)
+            response = self.fetch(api_call, params)
         except requests.exceptions.SSLError as e:
             print("[getAddress] SSL Cert Error")
             print(e)
             return None
 
         print("Getting address: ", api_call)
-        time.sleep(2)
-        if response.status_code == 200:
-            return response.json()
-        else:
+        if response.status_code != 200:
             return super().addrError(response.status_code, addr)
+        data = response.json()
+        # Only block-height bounds can be pushed down, so time bounds need
+        # us to page back through the history until we reach the window.
+        if full and scope and scope.hasWindow():
+            data["txs"] = self.pageWindow(addr, data, scope)
+        return data
+
+    def pageWindow(self, addr, data, scope):
+        """Collects the transactions of an address within a window
+
+        Blockcypher returns the newest transactions first and flags
+        older ones with hasMore. Older pages are requested with before
+        set to the oldest block height seen until we pass the start of
+        the window, collect txlimit transactions or reach the scope's
+        max_pages. Transactions sharing a block with the oldest one
+        seen on a page may be missed since before is exclusive.
+
+        Args:
+            addr: Hash of the address object in the blockchain.
+            data: Address JSON object from the first page
+            scope: CrawlScope with the window to collect
+
+        Returns: List of transactions within the window
+        """
+        txs = data["txs"]
+        found = [t for t in txs if scope.position(t) == 0]
+        pages = 1
+        while len(found) < self.txlimit and data.get("hasMore"):
+            confirmed = [t for t in txs if t.get("block_height", -1) >= 0]
+            if not confirmed or scope.position(confirmed[-1]) < 0:
+                break
+            if pages == scope.max_pages:
+                print("Warning - Stopped paging before the scope window for: ", addr)
+                break
+
+            api_call = self.base+self.address+addr+"/full?txlimit="+str(self.txlimit)
+            params = scope.heightParams()
+            params["before"] = confirmed[-1]["block_height"]
+            try:
+                response = self.fetch(api_call, params)
+            except requests.exceptions.RequestException as e:
+                print("[pageWindow] Request Error")
+                print(e)
+                print("Warning - Keeping ", len(found), " transactions for: ", addr)
+                break
+
+            print("Getting address: ", api_call, " before ", params["before"])
+            if response.status_code != 200:
+                super().addrError(response.status_code, addr)
+                print("Warning - Keeping ", len(found), " transactions for: ", addr)
+                break
+            data = response.json()
+            txs = data["txs"]
+            found.extend([t for t in txs if scope.position(t) == 0])
+            pages += 1
+        return found[:self.txlimit]
 
     def getTransaction(self, trans):
-        response = requests.get(self.base+self.transact+trans)
-        time.sleep(2)
+        self.status = None
+        self.latency = 0.0
+        response = self.fetch(self.base+self.transact+trans)
         if response.status_code == 200:
             return response.json()
         else:
             return super().transError(response.status_code, trans)
 
 class Blockstream(ApiEndpoint):
-    def __init__(self):
-        self.base = "https://blockstream.info/api"
+    """Esplora API Endpoint
+
+    Blockstream serves the Esplora API, which structures
+    transactions differently than Blockcypher. Responses are
+    normalized into the Blockcypher layout so the rest of the
+    exploration code does not need to know which API was used.
+    """
+
+    def __init__(self, base = "https://blockstream.info/api"):
+        super().__init__()
+        self.base = base
         self.address = "/address/"
         self.transact = "/tx/"
+        self.name = "blockstream"
+        self.txlimit = 50
 
-    def getAddress(self, addr):
-        response = requests.get(self.base+self.address+addr)
-        time.sleep(2)
-        if response.status_code == 200:
-            return response.json()
-        else:
+    def getAddress(self, addr, full = False, scope = None):
+        self.status = None
+        self.latency = 0.0
+        api_call = self.base+self.address+addr
+        if full:
+            # Esplora serves the transactions of an address from a separate
+            # endpoint which returns the 25 most recent transactions.
+            api_call = api_call + "/txs"
+        try:
+            response = self.fetch(api_call)
+        except requests.exceptions.RequestException as e:
+            print("[getAddress] Request Error")
+            print(e)
+            return None
+
+        print("Getting address: ", api_call)
+        if response.status_code != 200:
             return super().addrError(response.status_code, addr)
+        if not full:
+            return self.normalizeAddress(response.json())
+        txs = [self.normalizeTransaction(t) for t in response.json()]
+        # Esplora has no block-height or time bounds on address queries so
+        # we page back through the history until we reach the scope window.
+        if scope and scope.hasWindow():
+            txs = self.pageWindow(addr, txs, scope)
+        return {"address": addr, "txs": txs}
+
+    def pageWindow(self, addr, txs, scope):
+        """Collects the transactions of an address within a window
+
+        Esplora returns the newest transactions first and serves older
+        confirmed transactions 25 at a time, starting after the last
+        transaction hash seen. Pages are requested until we pass the
+        start of the window, collect txlimit transactions or reach
+        the scope's max_pages.
+
+        Args:
+            addr: Hash of the address object in the blockchain.
+            txs: Normalized transactions from the first page
+            scope: CrawlScope with the window to collect
+
+        Returns: List of normalized transactions within the window.
+            If a page cannot be retrieved, the transactions found
+            so far are returned.
+        """
+        found = [t for t in txs if scope.position(t) == 0]
+        pages = 1
+        while len(found) < self.txlimit:
+            confirmed = [t for t in txs if t["block_height"] >= 0]
+            if len(confirmed) < 25 or scope.position(confirmed[-1]) < 0:
+                break
+            if pages == scope.max_pages:
+                print("Warning - Stopped paging before the scope window for: ", addr)
+                break
+
+            api_call = self.base+self.address+addr+"/txs/chain/"+confirmed[-1]["hash"]
+            try:
+                response = self.fetch(api_call)
+            except requests.exceptions.RequestException as e:
+                print("[pageWindow] Request Error")
+                print(e)
+                print("Warning - Keeping ", len(found), " transactions for: ", addr)
+                break
+
+            print("Getting address: ", api_call)
+            if response.status_code != 200:
+                super().addrError(response.status_code, addr)
+                print("Warning - Keeping ", len(found), " transactions for: ", addr)
+                break
+            txs = [self.normalizeTransaction(t) for t in response.json()]
+            found.extend([t for t in txs if scope.position(t) == 0])
+            pages += 1
+        return found[:self.txlimit]
 
     def getTransaction(self, trans):
-        response = reequests.get(self.base+self.transact+trans)
-        time.sleep(2)
+        self.status = None
+        self.latency = 0.0
+        try:
+            response = self.fetch(self.base+self.transact+trans)
+        except requests.exceptions.RequestException as e:
+            print("[getTransaction] Request Error")
+            print(e)
+            return None
         if response.status_code == 200:
-            return response.json()
+            return self.normalizeTransaction(response.json())
         else:
             return super().transError(response.status_code, trans)
 
+    @staticmethod
+    def normalizeAddress(data):
+        """Converts an Esplora address to the Blockcypher layout
+
+        Args:
+            data: Address JSON object from the Esplora API
+
+        Returns: Dictionary with the balances and transaction
+            counts of the address using Blockcypher property names.
+        """
+        chain = data.get("chain_stats", {})
+        mempool = data.get("mempool_stats", {})
+        received = chain.get("funded_txo_sum", 0)
+        sent = chain.get("spent_txo_sum", 0)
+        unconfirmed = mempool.get("funded_txo_sum", 0) - mempool.get("spent_txo_sum", 0)
+        return { "address": data["address"],
+                "total_received": received,
+                "total_sent": sent,
+                "balance": received - sent,
+                "unconfirmed_balance": unconfirmed,
+                "final_balance": received - sent + unconfirmed,
+                "n_tx": chain.get("tx_count", 0),
+                "unconfirmed_n_tx": mempool.get("tx_count", 0),
+                "final_n_tx": chain.get("tx_count", 0) + mempool.get("tx_count", 0)}
+
+    @staticmethod
+    def normalizeTransaction(tx):
+        """Converts an Esplora transaction to the Blockcypher layout
+
+        Args:
+            tx: Transaction JSON object from the Esplora API
+
+        Returns: Dictionary with the hash, addresses, inputs,
+            outputs, block height and received timestamp of the
+            transaction using Blockcypher property names.
+        """
+        inputs = []
+        for vin in tx["vin"]:
+            # Coinbase inputs have no previous output to take an address from.
+            prevout = vin.get("prevout") or {}
+            addr = prevout.get("scriptpubkey_address")
+            inputs.append({"addresses": [addr] if addr else [],
+                    "output_value": prevout.get("value", 0)})
+
+        outputs = []
+        for vout in tx["vout"]:
+            addr = vout.get("scriptpubkey_address")
+            outputs.append({"addresses": [addr] if addr else [],
+                    "value": vout.get("value", 0)})
+
+        addresses = set([])
+        for i in inputs + outputs:
+            addresses = addresses.union(i["addresses"])
+
+        status = tx.get("status", {})
+        if status.get("block_time"):
+            received = datetime.fromtimestamp(status["block_time"], timezone.utc)
+        else:
+            received = datetime.now(timezone.utc)
+        return { "hash": tx["txid"],
+                "addresses": sorted(addresses),
+                "inputs": inputs,
+                "outputs": outputs,
+                "block_height": status.get("block_height", -1),
+                "received": received.strftime("%Y-%m-%dT%H:%M:%SZ")}
+
+class LocalNode(Blockstream):
+    """Esplora API served by a local node
+
+    Targets a self-hosted Esplora/electrs instance which exposes
+    the same REST interface as Blockstream without a request quota.
+    """
+
+    def __init__(self, base = "http://localhost:3000"):
+        super().__init__(base)
+        self.name = "local"
+        self.metered = False
+        self.delay = 0
+
+class ProviderRouter(ApiEndpoint):
+    """Routes requests across several API Endpoints
+
+    Spreads address and transaction requests over a list of
+    ApiEndpoint backends. Backends without a quota, such as a local
+    node, are always tried first. Otherwise each request goes to a
+    backend picked at random, weighted by the quota it has left. Rate limits
+    (429), server errors (5xx) and failed connections fail over to
+    the next backend. When hedge_delay is set, a request still
+    running after hedge_delay seconds is also sent to a second
+    backend and the first successful answer is used.
+
+    Attributes:
+        providers: List of ApiEndpoint backends to route between
+        hedge_delay: Seconds to wait on a backend's response before
+            hedging a request, or None to disable hedging.
+        default_quota: Weight given to backends which do not
+            report their remaining quota.
+        cooldown: Seconds a backend is skipped after a 429.
+        stats: Dictionary of per-backend request statistics
+    """
+
+    def __init__(self, providers, hedge_delay = None, default_quota = 100,
+            cooldown = 60):
+        super().__init__()
+        self.name = "router"
+        self.providers = providers
+        self.hedge_delay = hedge_delay
+        self.default_quota = default_quota
+        self.cooldown = cooldown
+        self.blocked = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers = len(providers))
+        self.stats = {}
+        for p in providers:
+            self.stats[p.name] = {"success": 0, "failure": 0, "hedged": 0,
+                    "latency": 0.0}
+
+    def getAddress(self, addr, full = False, scope = None):
+        return self.route("getAddress", addr, full = full, scope = scope)
+
+    def getTransaction(self, trans):
+        return self.route("getTransaction", trans)
+
+    def getStats(self):
+        """Summarizes the requests made to each backend
+
+        Returns: Dictionary keyed by backend name with the number of
+            successful, failed and hedged requests, the mean latency
+            of successful requests in seconds and the last known
+            remaining quota.
+        """
+        summary = {}
+        with self.lock:
+            for p in self.providers:
+                s = self.stats[p.name]
+                mean = s["latency"] / s["success"] if s["success"] else None
+                summary[p.name] = {"success": s["success"],
+                        "failure": s["failure"],
+                        "hedged": s["hedged"],
+                        "mean_latency": mean,
+                        "remaining": p.remaining}
+        return summary
+
+    def rankProviders(self):
+        """Orders the backends for a single request
+
+        Unmetered backends come first. Metered backends are drawn
+        at random weighted by their remaining quota. Backends cooling
+        down after a 429 are only tried once every other backend has
+        failed.
+
+        Returns: List of ApiEndpoint backends in the order to try them
+        """
+        now = time.time()
+        for p in self.providers:
+            # Once the cooldown is over the quota is unknown again until the
+            # backend reports it.
+            if p.name in self.blocked and self.blocked[p.name] <= now:
+                del self.blocked[p.name]
+                p.remaining = None
+        available = [p for p in self.providers if p.name not in self.blocked]
+        blocked = [p for p in self.providers if p.name in self.blocked]
+        order = [p for p in available if not p.metered]
+        available = [p for p in available if p.metered]
+        while available:
+            weights = [self.default_quota if p.remaining is None else p.remaining
+                    for p in available]
+            if sum(weights) > 0:
+                pick = random.choices(available, weights)[0]
+            else:
+                pick = available[0]
+            order.append(pick)
+            available.remove(pick)
+        blocked.sort(key = lambda p: self.blocked[p.name])
+        return order + blocked
+
+    def route(self, method, *args, **kwargs):
+        """Sends a request to the backends until one succeeds
+
+        Args:
+            method: Name of the ApiEndpoint function to call
+            args: Positional arguments for the function
+            kwargs: Keyword arguments for the function
+
+        Returns: The JSON object from the first backend to answer,
+            or None if every backend failed.
+        """
+        order = self.rankProviders()
+        while order:
+            futures = [self.submit(self.nextProvider(order), method, args, kwargs)]
+            if self.hedge_delay is not None and order:
+                done, _ = wait(futures, timeout = self.hedge_delay)
+                if not done:
+                    hedge = self.nextProvider(order)
+                    print("Hedging request to: ", hedge.name)
+                    with self.lock:
+                        self.stats[hedge.name]["hedged"] += 1
+                    futures.append(self.submit(hedge, method, args, kwargs))
+
+            failover = False
+            while futures:
+                done, futures = wait(futures, return_when = FIRST_COMPLETED)
+                for f in done:
+                    data, retry = f.result()
+                    if data is not None:
+                        return data
+                    failover = failover or retry
+                futures = list(futures)
+
+            # Errors such as a 404 from a public API will be the same on
+            # every public API so there is no point in asking the others.
+            if not failover:
+                return None
+        print("Error - All providers failed for: ", args[0])
+        return None
+
+    def nextProvider(self, order):
+        """Takes the next backend to try from order
+
+        A backend still busy with a hedged request from an earlier
+        call is passed over in favour of an idle one, so a slow
+        backend does not hold up the following requests.
+
+        Args:
+            order: List of backends from rankProviders, which is
+                updated in place
+
+        Returns: The ApiEndpoint backend to use
+        """
+        for p in order:
+            previous = self.pending.get(p.name)
+            if not previous or previous.done():
+                order.remove(p)
+                return p
+        return order.pop(0)
+
+    def submit(self, provider, method, args, kwargs):
+        """Schedules a request on a backend
+
+        A backend only handles one request at a time since it keeps
+        the status of its latest request. If every backend was busy
+        and a hedged request is still running on this one, we wait
+        for it before reusing it. The backend's pacing delay is also
+        waited out here so that it does not count towards hedge_delay.
+
+        Returns: Future resolving to the data and whether the request
+            should fail over to another backend
+        """
+        previous = self.pending.get(provider.name)
+        if previous:
+            previous.result()
+        provider.pace()
+        future = self.pool.submit(self.call, provider, method, args, kwargs)
+        self.pending[provider.name] = future
+        return future
+
+    def call(self, provider, method, args, kwargs):
+        try:
+            data = getattr(provider, method)(*args, **kwargs)
+        except Exception as e:
+            print("[call] ", provider.name, " raised: ", e)
+            provider.status = None
+            data = None
+        latency = provider.latency
+
+        status = provider.status
+        # A local node may be unsynced or missing an index, so any error
+        # from an unmetered backend is worth retrying on a public API.
+        retry = data is None and (not provider.metered or status is None
+                or status == 429 or status >= 500)
+        with self.lock:
+            if data is not None:
+                self.stats[provider.name]["success"] += 1
+                self.stats[provider.name]["latency"] += latency
+            else:
+                self.stats[provider.name]["failure"] += 1
+            if status == 429:
+                provider.remaining = 0
+                self.blocked[provider.name] = time.time() + self.cooldown
+        return data, retry
+
+class CrawlScope:
+    """Bounds on the transactions followed during exploration
+
+    Restricts the crawl to transactions inside a block-height or
+    time window and to transfers of at least a minimum value.
+    Block-height bounds are pushed down into the provider query
+    where the API supports them. Every bound is also checked in
+    expandTransaction so out of scope transactions never add
+    addresses to the next layer.
+
+    Attributes:
+        since: Earliest block height (int) or time (datetime) of
+            transactions to follow, or None.
+        until: Latest block height (int) or time (datetime) of
+            transactions to follow, or None.
+        min_value: Minimum amount in satoshis an address must send
+            or receive in a transaction to be followed.
+        max_pages: Maximum number of pages requested per address
+            when paging back through its history to the window.
+    """
+
+    def __init__(self, since = None, until = None, min_value = 0,
+            max_pages = 10):
+        self.since = since
+        self.until = until
+        self.min_value = min_value
+        self.max_pages = max_pages
+
+    @staticmethod
+    def parseBound(value, end = False):
+        """Parses a --since or --until command line value
+
+        Args:
+            value: Block height or ISO 8601 date/time string. Times
+                without a timezone are taken as UTC.
+            end: If True, a date without a time is taken as the end
+                of that day rather than its start.
+
+        Returns: An int block height or a timezone aware datetime
+        """
+        if value.isdigit():
+            return int(value)
+        try:
+            day = date.fromisoformat(value)
+        except ValueError:
+            day = None
+        if day is not None:
+            return datetime.combine(day, dtime.max if end else dtime.min,
+                    tzinfo = timezone.utc)
+        bound = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if bound.tzinfo is None:
+            bound = bound.replace(tzinfo = timezone.utc)
+        return bound
+
+    @staticmethod
+    def parseUntil(value):
+        """Parses an --until command line value
+
+        Same as parseBound except that a date on its own includes
+        the whole day.
+        """
+        return CrawlScope.parseBound(value, end = True)
+
+    def hasWindow(self):
+        """Returns True if the scope has a since or until bound"""
+        return self.since is not None or self.until is not None
+
+    def heightParams(self):
+        """Builds the block-height query parameters for Blockcypher
+
+        Blockcypher's after and before parameters are exclusive so
+        the bounds are widened by one block.
+
+        Returns: Dictionary of query parameters, empty if there are
+            no block-height bounds.
+        """
+        params = {}
+        if isinstance(self.since, int):
+            params["after"] = self.since - 1
+        if isinstance(self.until, int):
+            params["before"] = self.until + 1
+        return params
+
+    def inWindow(self, t_data):
+        """Checks a transaction against the since and until bounds
+
+        Args:
+            t_data: Transaction JSON object
+
+        Returns: True if the transaction falls within the window
+        """
+        return self.position(t_data) == 0
+
+    def position(self, t_data):
+        """Places a transaction relative to the since and until bounds
+
+        Args:
+            t_data: Transaction JSON object
+
+        Returns: -1 if the transaction is before since, 1 if it is
+            after until and 0 if it falls within the window
+        """
+        # Unconfirmed transactions have a block height of -1 and are
+        # newer than any confirmed block.
+        height = t_data.get("block_height", -1)
+        if height is None or height < 0:
+            height = float("inf")
+        received = datetime.strptime(t_data["received"][:19],
+                "%Y-%m-%dT%H:%M:%S").replace(tzinfo = timezone.utc)
+
+        if self.since is not None:
+            value = height if isinstance(self.since, int) else received
+            if value < self.since:
+                return -1
+        if self.until is not None:
+            value = height if isinstance(self.until, int) else received
+            if value > self.until:
+                return 1
+        return 0
+
 def nextAddresses(next_url, next_key, key):
     """Retrieve remaining inputs or outputs from endpoint.
 
@@ -216,7 +836,9 @@ def getNewAddresses(t_data, key):
 
     Creates key-value pairs from the addresses and currency
     sent or received by the address. The function uses key
-    to generalize between input and output lists.
+    to generalize between input and output lists. An address
+    appearing in several inputs or outputs has its amounts
+    summed.
 
     Args:
         t_data: Transaction data from the API
@@ -239,12 +861,12 @@ def getNewAddresses(t_data, key):
             print("Transaction ", t_data["hash"], " has more than one address.")
         for addr in i["addresses"][:5]:
             if key == "inputs":
-                inputs[addr] = i["output_value"]
+                inputs[addr] = inputs.get(addr, 0) + i["output_value"]
             else:
-                inputs[addr] = i["value"]
+                inputs[addr] = inputs.get(addr, 0) + i["value"]
     return inputs
 
-def expandTransaction(t_data):
+def expandTransaction(t_data, scope = None, address = None):
     """Extracts neighboring addresses from transaction
 
     Extracts the input and output addresses connected to
@@ -252,35 +874,64 @@ def expandTransaction(t_data):
     complete list of addresses so the function makes
     subsequent calls to retrieve the complete list.
 
+    When a scope is given, transactions outside its window
+    are skipped. The whole transaction is also skipped when
+    the crawled address sends and receives less than the
+    minimum value in it. Otherwise any other address moving
+    less than the minimum value is dropped before it becomes
+    a neighbor.
+
     Args:
         t_data: Transaction JSON object
+        scope: Optional CrawlScope bounding the exploration
+        address: Hash of the address being crawled, used to
+            check its own edge against the minimum value
 
     Returns: Dictionary with the connected addresses
         organized into inputs and outputs. The
         timestamp of the transaction is also included.
+        The dictionary is None if the transaction is
+        out of scope.
     """
     
     neighbors = set([])
+    if scope and not scope.inWindow(t_data):
+        print("    Transaction out of scope")
+        return None, neighbors
+
     print("    Getting Inputs")
     inputs = getNewAddresses(t_data, "inputs")
-    neighbors = neighbors.union(inputs.keys())
     # if "next_inputs" in t_data.keys():
         # print("    Input getting additional addresses")
         # inputs.update(nextAddresses(t_data["next_inputs"], "next_inputs", "inputs"))
 
     print("    Getting Outputs")
     outputs = getNewAddresses(t_data, "outputs")
-    neighbors = neighbors.union(outputs.keys())
     # if "next_outputs" in t_data.keys():
         # print("    Output getting additional addresses")
         # outputs.update(nextAddresses(t_data["next_outputs"], "next_outputs", "outputs"))
 
+    if scope:
+        # A dust transfer into or out of the crawled address prunes the whole
+        # branch. The address may be missing if the input or output lists
+        # were truncated, in which case only the per-address rule applies.
+        own = [e[address] for e in (inputs, outputs) if address in e]
+        if own and max(own) < scope.min_value:
+            print("    Transaction below minimum value")
+            return None, neighbors
+        inputs = {a: v for a, v in inputs.items() if v >= scope.min_value}
+        outputs = {a: v for a, v in outputs.items() if v >= scope.min_value}
+    neighbors = neighbors.union(inputs.keys()).union(outputs.keys())
+
+    if not inputs and not outputs:
+        return None, neighbors
+
     interactions = { "inputs": inputs,
             "outputs": outputs,
             "timestamp": t_data["received"]}
     return interactions, neighbors
 
-def getNeighbors(block_api, address, transactions):
+def getNeighbors(block_api, address, transactions, scope = None):
     """Retrieves an address's neighboring addresses
 
     Iterates through the transactions associated with the
@@ -295,6 +946,7 @@ def getNeighbors(block_api, address, transactions):
         address: String hash of address to expand
         transactions: Python set containing all
             previously traversed transaction hashes
+        scope: Optional CrawlScope bounding the exploration
 
     Returns:
         transactions: Python set containing all
@@ -309,7 +961,7 @@ def getNeighbors(block_api, address, transactions):
     # We use the full Address endpoint to reduce the number of requests
     # made per run. However, doing so reduces the number of transactions
     # available in a single call.
-    data = block_api.getAddress(address, full=True)
+    data = block_api.getAddress(address, full=True, scope=scope)
     if not data:
         print("No data for address: ", address)
         return transactions, set([]), None
@@ -318,15 +970,19 @@ def getNeighbors(block_api, address, transactions):
     for trans in data["txs"]:
         if trans["hash"] not in transactions:
             print("  Expanding transaction: ", trans["hash"])
-            transactions.add(trans["hash"])
             t_data = trans #block_api.getTransaction(trans['tx_hash'])
             print("  Addresses involved in transaction: ", len(t_data["addresses"]))
-            t, n = expandTransaction(t_data)
+            t, n = expandTransaction(t_data, scope, address)
+            # A transaction pruned as dust for this address may still be in
+            # scope for another, so it is only marked once expanded.
+            if t is None:
+                continue
+            transactions.add(trans["hash"])
             neighbors = neighbors.union(n)
             neighbor_links[trans["hash"]] = t
     return transactions, neighbors, neighbor_links
 
-def getNetwork(block_api, address, jumps):
+def getNetwork(block_api, address, jumps, scope = None):
     """Get addresses N hops away
 
     Uses Breadth First Search to find all nodes N hops away from
@@ -339,25 +995,34 @@ def getNetwork(block_api, address, jumps):
         block_api: ApiEndpoint subclass used to make API requests
         address: Starting address at the center of the network
         jumps: Number of hops to expand away from the address
+        scope: Optional CrawlScope bounding the exploration
 
     Returns: Dictionary of addresses and transactions found by
         the algorithm.
     """
 
     network = {}
+    failed = set([])
     trans = set([])
     current_layer = set([address])
     for i in range(jumps):
         print("Starting jump: ", i)
         next_layer = set([])
         for addr in current_layer:
-            trans, neighbors, links = getNeighbors(block_api, addr, trans)
+            trans, neighbors, links = getNeighbors(block_api, addr, trans, scope)
+            # Addresses we failed to retrieve are left out of the network
+            # rather than recorded as None so writeData only sees real data.
+            if links is None:
+                failed.add(addr)
+                continue
             network[addr] = links
             # Keys to the network are the address hashes of all nodes we've
             # visited.  We only want to add nodes to next_layer which we
             # haven't visited. We will explore next_layer in the next jump.
             next_layer = next_layer.union(neighbors.difference(network.keys()))
-        current_layer = next_layer
+        current_layer = next_layer.difference(failed)
+    if failed:
+        print("Failed to retrieve ", len(failed), " addresses: ", failed)
     return network
 
 def writeData(data):
@@ -404,14 +1069,41 @@ if __name__ == "__main__":
     api_group = parser.add_mutually_exclusive_group(required=True)
     api_group.add_argument("-bc", "--blockcypher", action = "store_true")
     api_group.add_argument("-bs", "--blockstream", action = "store_true")
+    api_group.add_argument("-r", "--router", action = "store_true",
+            help = "Route requests across Blockcypher, Blockstream and --local-node")
     parser.add_argument("address", help = "Extract information for specified address")
     parser.add_argument("-n", "--hops", default = 3, type = int, help = "Number of steps away from address")
+    parser.add_argument("--local-node", help = "Base URL of a local Esplora API used by --router")
+    parser.add_argument("--hedge", type = float,
+            help = "Seconds before --router hedges a slow request to another provider")
+    parser.add_argument("--since", type = CrawlScope.parseBound,
+            help = "Earliest block height or ISO 8601 time of transactions to follow")
+    parser.add_argument("--until", type = CrawlScope.parseUntil,
+            help = "Latest block height or ISO 8601 time of transactions to follow. "
+            "A date on its own includes the whole day")
+    parser.add_argument("--min-value", default = 0, type = int,
+            help = "Minimum satoshis moved by an address in a transaction. Transactions "
+            "where the crawled address moves less are skipped entirely")
+    parser.add_argument("--max-pages", default = 10, type = int,
+            help = "Maximum pages of history requested per address to reach the "
+            "--since/--until window")
     args = parser.parse_args()
 
     if args.blockcypher:
         block_api = Blockcypher()
     elif args.blockstream:
         block_api = Blockstream()
+    elif args.router:
+        providers = [Blockcypher(), Blockstream()]
+        if args.local_node:
+            providers.append(LocalNode(args.local_node))
+        block_api = ProviderRouter(providers, hedge_delay = args.hedge)
+
+    scope = None
+    if args.since is not None or args.until is not None or args.min_value:
+        scope = CrawlScope(args.since, args.until, args.min_value, args.max_pages)
 
-    data = getNetwork(block_api, args.address, args.hops)
-    writeData(data)
\ No newline at end of file
+    data = getNetwork(block_api, args.address, args.hops, scope)
+    writeData(data)
+    if args.router:
+        bc_printer.pprint(block_api.getStats())
\ No newline at end of file